@@ -1,30 +1,25 @@
+import asyncio
 import logging
 import os
 import time
-import threading
 import tempfile
 from datetime import datetime, timezone, timedelta
-from requests import HTTPError
 
 import discord
 from discord import app_commands
 from discord.ext import tasks
 
 from log import init_log, LOG_NAME
-from db import init_db, get_db
-from rsapi import *
+from db import init_db, get_db, get_read_db
+from rsapi import ActivityLog, ClanMember, PrivateProfileException, fetch_clan_members, fetch_user_cap_activities, get_date_timestamp, get_rate_limited_until
 
 CLAN_NAME = "Unknown"
 MAX_FAILURES = 5
 MAX_USER_QUERIES = 15
+MAX_CONCURRENT_QUERIES = 5
+MIN_QUERY_INTERVAL = 3 # seconds between alog requests starting, keeps us at the API's ~20 requests/minute
 UPDATE_LOOP_MINUTES = 2
 
-def get_date_timestamp(date:str) -> float:
-    """ Parses the date from a date string (RS Alog format) and returns it as a timestamp. """
-    dt = datetime.strptime(date, "%d-%b-%Y %H:%M")
-    dt = dt.replace(tzinfo=timezone.utc)
-    return dt.timestamp()
-
 def timestamp_to_date(timestamp) -> str:
     """ Converts a timestamp into a date string (RS Alog format). """
     dt = datetime.fromtimestamp(timestamp, tz=timezone.utc)
@@ -39,63 +34,92 @@ def get_offset_from_now_timestamp(delta:timedelta) -> int:
 def format_timestamp_for_discord(timestamp) -> str:
     return f"<t:{timestamp}:f>"
 
-def get_user_activities(users:list[str], cancel_event:threading.Event, num_activities:int=20) -> dict[str, ActivityLog]:
+def fetch_activity_log(rsn:str, num_activities:int, last_cap_timestamp:int) -> ActivityLog:
+    """ Fetches the adventure's log for a single user. Private profiles are returned as an empty private ActivityLog. """
+    log = logging.getLogger(LOG_NAME)
+    log.debug("Fetching alog for %s", rsn)
+    try:
+        return fetch_user_cap_activities(rsn, num_activities, last_cap_timestamp)
+    except PrivateProfileException:
+        log.warning("Failed to fetch activities for %s: runemetrics profile is private", rsn)
+        return ActivityLog(private=True, latest_date=None, cap_dates=())
+
+async def get_user_activities(users:list[str], last_cap_timestamps:dict[str, int], num_activities:int=20) -> dict[str, ActivityLog]:
     """
     Fetches the adventure's log for each user in the list.
+    last_cap_timestamps holds the latest cap we've already recorded for each user (rsn -> timestamp) so older activities can be skipped.
+    The requests are almost entirely waiting on the network so we run a few of them concurrently.
     Handles Jamflex's extreme rate limiting.
     Returns a dict of rsn -> ActivityLog.
     """
     log = logging.getLogger("CapBot")
-    log.debug(f"Fetching last {num_activities} activities for {len(users)} users.")
+    log.debug("Fetching last %d activities for %d users.", num_activities, len(users))
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    start_lock = asyncio.Lock()
+    next_start = 0.0
+    async def fetch(rsn:str) -> ActivityLog:
+        nonlocal next_start
+        async with semaphore:
+            # Space out request starts across all the workers, and hold all of them off while the server is rate limiting us.
+            async with start_lock:
+                while True:
+                    delay = max(next_start, get_rate_limited_until()) - time.monotonic()
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+                next_start = time.monotonic() + MIN_QUERY_INTERVAL
+            return await asyncio.to_thread(fetch_activity_log, rsn, num_activities, last_cap_timestamps.get(rsn, 0))
 
-    request_delay = 10
     num_failures = 0
-    index = 0
     activity_dict = {}
-    while index < len(users):
-        if cancel_event.is_set():
-            return activity_dict
-        
-        rsn = users[index]
-        try:
-            time.sleep(0) # delay between each request to reduce 429 errors
-
-            log.debug(f"Fetching alog for {rsn}")
-            activities = fetch_user_activites(rsn, num_activities)
-            activity_dict[rsn] = ActivityLog(private=False, activities=activities)
-
-            index += 1
-            request_delay = 10 # Reset as we had a success
-
-        except PrivateProfileException:
-            log.warning(f"Failed to fetch activities for {rsn}: runemetrics profile is private")
-            activity_dict[rsn] = ActivityLog(private=True, activities=[])
-            index += 1
-
-        except HTTPError as http_error:
-            if http_error.response.status_code == 429: # Too many requests
-                log.warning(f"Received 'Too many requests' response. Waiting {request_delay} seconds")
-                time.sleep(request_delay)
-                request_delay *= 2 # double each time
-                if request_delay > 100:
-                    log.error("Max request delay exceeded. Skipping further requests")
-                    break
-                # Don't increment index so we retry
-                continue
-            raise http_error # unhandled; fallback to below block
-        
-        except Exception as ex:
-            log.exception(f"Failed to fetch user activities for {rsn}: {ex}")
-            num_failures += 1
-            if num_failures > MAX_FAILURES:
-                log.error(f"Exceeded max failures for fetching user activites. Stopping further queries.")
-                return activity_dict
-            index += 1 # skip this user
-            continue
-    
+    fetch_tasks = {asyncio.create_task(fetch(rsn)): rsn for rsn in users}
+    pending = set(fetch_tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                rsn = fetch_tasks[task]
+                try:
+                    activity_dict[rsn] = task.result()
+
+                except Exception as ex:
+                    log.exception("Failed to fetch user activities for %s: %s", rsn, ex)
+                    num_failures += 1
+                    if num_failures > MAX_FAILURES:
+                        log.error("Exceeded max failures for fetching user activites. Stopping further queries.")
+                        return activity_dict
+    finally:
+        # Drop any queries that haven't started yet if we stopped early or were cancelled.
+        for task in pending:
+            task.cancel()
+
     return activity_dict
 
-def update_task(cancel_event:threading.Event):
+def load_users_to_query(clan_members:list[ClanMember]) -> tuple[list[str], dict[str, int]]:
+    """
+    Adds any new clan members to the user_activity table and picks the users to query this update.
+    Returns the rsns to query and the latest recorded cap timestamp for each of them (rsn -> timestamp).
+    """
+    log = logging.getLogger(LOG_NAME)
+    with get_db() as dbcon:
+        # Insert any new rsns into the activity table. We default the timestamps to 0 to ensure they'll be queried in the next step.
+        rows = [(member.rsn,0,0) for member in clan_members]
+        cur = dbcon.executemany("INSERT OR IGNORE INTO user_activity(rsn, last_activity_timestamp, last_query_timestamp) VALUES(?,?,?)", rows)
+        log.debug("Added %d new users into the user_activity table.", cur.rowcount)
+
+        # Get all users that have been active in the last week, or we haven't checked recently.
+        # Only query a few at a time as it's very slow due to Jagex rate limits.
+        cur = dbcon.execute("SELECT rsn FROM user_activity ORDER BY last_query_timestamp ASC LIMIT ?", (MAX_USER_QUERIES,))
+        users_to_query = [row[0] for row in cur.fetchall()]
+
+        # Latest cap we already have for each user being queried. Anything in their alog at or before this has already been processed.
+        placeholders = ",".join(["?"] * len(users_to_query))
+        cur = dbcon.execute(f"SELECT rsn, MAX(cap_timestamp) FROM cap_events WHERE rsn IN ({placeholders}) GROUP BY rsn", users_to_query)
+        last_cap_timestamps:dict[str, int] = dict(cur.fetchall())
+    return users_to_query, last_cap_timestamps
+
+async def update_task():
     """
     Background task to update the activity database for all the clan members.
 
@@ -111,22 +135,14 @@ def update_task(cancel_event:threading.Event):
 
     # Fetch all clan members from rs api so we always have up to date list.
     try:
-        log.info(f"Fetching clan members for {CLAN_NAME}")
-        clan_members:list[ClanMember] = fetch_clan_members(CLAN_NAME)
+        log.info("Fetching clan members for %s", CLAN_NAME)
+        clan_members:list[ClanMember] = await asyncio.to_thread(fetch_clan_members, CLAN_NAME)
     except Exception as ex:
-        log.exception(f"Failed to fetch clan members for {CLAN_NAME}: {ex}")
+        log.exception("Failed to fetch clan members for %s: %s", CLAN_NAME, ex)
         return
 
-    with get_db() as dbcon:
-        # Insert any new rsns into the activity table. We default the timestamps to 0 to ensure they'll be queried in the next step.
-        rows = [(member.rsn,0,0) for member in clan_members]
-        cur = dbcon.executemany("INSERT OR IGNORE INTO user_activity(rsn, last_activity_timestamp, last_query_timestamp) VALUES(?,?,?)", rows)
-        log.debug(f"Added {cur.rowcount} new users into the user_activity table.")
-
-        # Get all users that have been active in the last week, or we haven't checked recently.
-        # Only query a few at a time as it's very slow due to Jagex rate limits.
-        cur = dbcon.execute(f"SELECT rsn FROM user_activity ORDER BY last_query_timestamp ASC LIMIT {MAX_USER_QUERIES}")
-        users_to_query = [row[0] for row in cur.fetchall()]
+    # Like the write below, this may have to wait on the database lock, so keep it off the event loop.
+    users_to_query, last_cap_timestamps = await asyncio.to_thread(load_users_to_query, clan_members)
 
     if len(users_to_query) == 0:
         log.debug("No users to query.")
@@ -137,7 +153,7 @@ def update_task(cancel_event:threading.Event):
     private_profiles = set()
 
     # Query the user alogs. 
-    user_activities:dict[str, ActivityLog] = get_user_activities(users_to_query, cancel_event)
+    user_activities:dict[str, ActivityLog] = await get_user_activities(users_to_query, last_cap_timestamps)
 
     for rsn, activity_log in user_activities.items():
         if activity_log.private:
@@ -145,34 +161,43 @@ def update_task(cancel_event:threading.Event):
             continue
 
         # Find any cap events
-        for activity in get_cap_events(activity_log.activities):
-            timestamp = get_date_timestamp(activity.date)
-            cap_events.append({"rsn": rsn, "cap_timestamp": timestamp})
+        for cap_date in activity_log.cap_dates:
+            timestamp = get_date_timestamp(cap_date)
+            cap_events.append({"rsn": rsn, "cap_timestamp": timestamp, "cap_date": cap_date})
 
-        # Get latest activity date, which is always the first activity in the list
-        if len(activity_log.activities) > 0:
-            timestamp = get_date_timestamp(activity_log.activities[0].date)
+        # Get latest activity date
+        if activity_log.latest_date is not None:
+            timestamp = get_date_timestamp(activity_log.latest_date)
             latest_activities.append({"rsn": rsn, "last_activity_timestamp": timestamp})
 
+    # The write may have to wait on the database lock, so keep it off the event loop.
+    await asyncio.to_thread(save_update_results, users_to_query, user_activities, cap_events, latest_activities, private_profiles)
+    log.debug("update_task completed after %s seconds.", time.time() - start_time)
+
+def save_update_results(users_to_query:list[str], user_activities:dict[str, ActivityLog], cap_events:list[dict], latest_activities:list[dict], private_profiles:set[str]):
+    """ Writes the results of an update_task run to the database in a single transaction. """
+    log = logging.getLogger(LOG_NAME)
     with get_db() as dbcon:
+        # Take the write lock up front so all the updates below land in a single transaction.
+        dbcon.execute("BEGIN IMMEDIATE")
+
         # Add new cap events
-        insert_rows = [(event["rsn"], event["cap_timestamp"], "auto") for event in cap_events]
-        cur = dbcon.executemany("INSERT OR IGNORE INTO cap_events(rsn, cap_timestamp, source) VALUES(?,?,?)", insert_rows)
-        log.debug(f"Inserted {cur.rowcount} new rows into cap_events. Rows = {insert_rows}")
+        insert_rows = [(event["rsn"], event["cap_timestamp"], event["cap_date"], "auto") for event in cap_events]
+        cur = dbcon.executemany("INSERT OR IGNORE INTO cap_events(rsn, cap_timestamp, cap_date, source) VALUES(?,?,?,?)", insert_rows)
+        # Pass the rows as logging args so the (potentially large) list is only formatted if debug logging is enabled.
+        log.debug("Inserted %d new rows into cap_events. Rows = %s", cur.rowcount, insert_rows)
 
         # Update user_activity table with last activities/query time.
         # Hard-coding private to false since it can't be true if we have activities.
-        now = datetime.now(timezone.utc).timestamp()
+        now = int(datetime.now(timezone.utc).timestamp())
         user_activity_rows = [(event["last_activity_timestamp"], now, event["rsn"]) for event in latest_activities]
         cur = dbcon.executemany("UPDATE user_activity SET last_activity_timestamp = ?, last_query_timestamp = ?, private = 0 WHERE rsn = ?", user_activity_rows)
-        log.debug(f"Updated last_activity_timestamp for {cur.rowcount} rows in user_activity. Rows = {user_activity_rows}")
+        log.debug("Updated last_activity_timestamp for %d rows in user_activity. Rows = %s", cur.rowcount, user_activity_rows)
 
         # Update query time for users we queried but got no activity data from. This may be due to private alogs.
-        no_activity_rows = [(now, (1 if rsn in private_profiles else 0), rsn) for rsn in users_to_query if rsn not in user_activities or len(user_activities[rsn].activities) == 0]
+        no_activity_rows = [(now, (1 if rsn in private_profiles else 0), rsn) for rsn in users_to_query if rsn not in user_activities or user_activities[rsn].latest_date is None]
         cur = dbcon.executemany("UPDATE user_activity SET last_query_timestamp = ?, private = ? WHERE rsn = ?", no_activity_rows)
-        log.debug(f"Updated last_query_timestamp for {cur.rowcount} in-active users in user_activity. Rows = {no_activity_rows}")
-
-    log.debug(f"update_task completed after {time.time() - start_time} seconds.")
+        log.debug("Updated last_query_timestamp for %d in-active users in user_activity. Rows = %s", cur.rowcount, no_activity_rows)
 
 class DiscordClient(discord.Client):
     def __init__(self, intents:discord.Intents):
@@ -180,8 +205,7 @@ class DiscordClient(discord.Client):
         self.tree = app_commands.CommandTree(self)
         self.logger = logging.getLogger(LOG_NAME)
         self.guild_id = discord.Object(id=os.getenv("GUILD_ID"))
-        self.task_thread = None
-        self.task_cancel_event = threading.Event()
+        self.current_task:asyncio.Task|None = None
 
     async def setup_hook(self):
         # Copy our slash commands to the discord server we're running in.
@@ -198,66 +222,70 @@ class DiscordClient(discord.Client):
             self.logger.info("Not starting update_database_task due to 'CAPBOT_DISABLE_SCAN_TASK' being set.")
 
     async def close(self):
-        # Kill the update thread before shutting down.
-        self.logger.debug("Waiting for update_task thread to exit...")
-        if self.task_thread and self.task_thread.is_alive():
-            self.task_cancel_event.set()
-            self.task_thread.join(timeout=30)
-            if self.task_thread.is_alive():
-                self.logger.error("Timed out waiting for update_task thread to join.")
+        # Cancel the update task before shutting down.
+        if self.current_task and not self.current_task.done():
+            self.logger.debug("Waiting for update_task to exit...")
+            self.current_task.cancel()
+            await asyncio.gather(self.current_task, return_exceptions=True)
         await super().close()
 
     @tasks.loop(minutes=UPDATE_LOOP_MINUTES)
     async def update_database_task(self):
         """ Scheduled looping update to run the background update. """
-        if self.task_thread and self.task_thread.is_alive():
-            self.logger.error("update_task thread is still alive. Skipping update")
+        if self.current_task and not self.current_task.done():
+            self.logger.error("update_task is still running. Skipping update")
             return
 
-        self.logger.debug("Starting update_task thread")
-        self.task_thread = threading.Thread(target=update_task, args=(self.task_cancel_event,))
-        self.task_thread.start()
+        self.logger.debug("Starting update_task")
+        self.current_task = asyncio.create_task(update_task())
+        self.current_task.add_done_callback(self.on_update_task_done)
+
+    def on_update_task_done(self, task:asyncio.Task):
+        """ Logs any exception that escaped update_task, as nothing else awaits its result. """
+        if task.cancelled():
+            return
+        ex = task.exception()
+        if ex is not None:
+            self.logger.exception("update_task failed: %s", ex, exc_info=ex)
 
 
 intents = discord.Intents.default()
 discord_client = DiscordClient(intents)
 
 def create_table(column_names:list[str], rows:list[list[str]], newline:str='\n'):
+    # Convert the cells to strings once so they aren't re-formatted when measuring and again when padding.
+    rows = [[str(cell) for cell in row] for row in rows]
+
     # Find longest strings in each column so we can pad out the rest to match.
-    column_widths:list[int] = [0] * len(column_names)
-    for row in rows + [column_names]:
-        for i in range(len(column_names)):
-            column_widths[i] = max(column_widths[i], len(str(row[i])))
+    column_widths:list[int] = [max(map(len, column)) for column in zip(column_names, *rows)]
 
     # Compute table size
     vertical_bars = len(column_names) + 1
     padding = len(column_names) * 2
     table_width = sum(column_widths) + vertical_bars + padding
 
-    def horizontal_line():
-        return ('-' * table_width) + newline
-    
-    table = horizontal_line()
-    table += "|" + "|".join([f" {column_names[i]:<{column_widths[i]}} " for i in range(len(column_widths))]) + "|" + newline
-    table += horizontal_line()
+    # Build the row template once with the widths baked in rather than re-parsing the format spec for every cell.
+    row_format = "|" + "|".join([f" {{:<{width}}} " for width in column_widths]) + "|"
 
-    for row in rows:
-        table += "|" + "|".join([f" {row[i]:<{column_widths[i]}} " for i in range(len(column_widths))]) + "|" + newline
-    table += horizontal_line()
-    return table
+    # Collect the lines and join once at the end; appending to a str in the loop re-copies the whole table per row.
+    horizontal_line = '-' * table_width
+    lines = [horizontal_line, row_format.format(*column_names), horizontal_line]
+    lines.extend(row_format.format(*row) for row in rows)
+    lines.append(horizontal_line)
+    return newline.join(lines) + newline
 
 @discord_client.tree.command(name="caplist", description="Get the list of users that have capped in the last N days.")
 async def caplist(interaction:discord.Interaction, days:int=7):
     now = datetime.now(timezone.utc)
     start_date = now - timedelta(days=days)
     timestamp = int(start_date.timestamp()) # Truncate as we only care about seconds
-    with get_db() as db:
-        con = db.execute(f"SELECT rsn,cap_timestamp FROM cap_events WHERE cap_timestamp >= {timestamp}")
-        rows = [(row[0], row[1]) for row in con.fetchall()]
-        rows.sort(key=lambda pair: pair[1], reverse=True) # sort by date
+    with get_read_db() as db:
+        con = db.execute("SELECT rsn,cap_timestamp,cap_date FROM cap_events WHERE cap_timestamp >= ? ORDER BY cap_timestamp DESC", (timestamp,))
+        rows = con.fetchall()
 
         column_headers = ["RSN", "Cap Date (Game Time)"]
-        rows = [[rsn, timestamp_to_date(cap_timestamp)] for rsn, cap_timestamp in rows]
+        # Rows inserted before cap_date was added won't have it, so fall back to formatting the timestamp.
+        rows = [[rsn, cap_date or timestamp_to_date(cap_timestamp)] for rsn, cap_timestamp, cap_date in rows]
         message = f"### Users that Capped in the last {days} days\n"
         message += f"```\n{create_table(column_headers, rows)}```"
     await interaction.response.send_message(message, ephemeral=True)
@@ -267,46 +295,46 @@ async def captotal(interaction:discord.Interaction, days:int=0):
     now = datetime.now(timezone.utc)
     start_date = now - timedelta(days=days) if days > 0 else datetime(year=1995, month=1, day=1)
     timestamp = int(start_date.timestamp()) # Truncate as we only care about seconds
-    with get_db() as db:
-        con = db.execute(f"""
+    with get_read_db() as db:
+        con = db.execute("""
             SELECT 
                 rsn,
                 COUNT(rsn) as cap_count 
             FROM cap_events 
-            WHERE cap_timestamp >= {timestamp}
+            WHERE cap_timestamp >= ?
             GROUP BY rsn
-            ORDER BY cap_count DESC""")
+            ORDER BY cap_count DESC""", (timestamp,))
         rows = [(row[0], row[1]) for row in con.fetchall()]
 
-        column_headers = ["RSN", "Total Citadel Caps"]
-        rows = [[rsn, cap_count] for rsn, cap_count in rows]
-        message = f"### Total Citadel Caps per user"
-        message += f" in the last {days} days" if days > 0 else ""
+    column_headers = ["RSN", "Total Citadel Caps"]
+    rows = [[rsn, cap_count] for rsn, cap_count in rows]
+    message = f"### Total Citadel Caps per user"
+    message += f" in the last {days} days" if days > 0 else ""
 
-        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
-            temp_filename = f.name
-            table = create_table(column_headers, rows)
-            f.write(table)
-            f.close()
-            try:
-                await interaction.response.send_message(message, file=discord.File(temp_filename), ephemeral=True)
-            finally:
-                os.remove(temp_filename)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        temp_filename = f.name
+        table = create_table(column_headers, rows)
+        f.write(table)
+        f.close()
+        try:
+            await interaction.response.send_message(message, file=discord.File(temp_filename), ephemeral=True)
+        finally:
+            os.remove(temp_filename)
 
 @discord_client.tree.command(name="list-private-alogs", description="List any users that have their alog set to private")
 async def list_private_alogs(interaction:discord.Interaction):
-    with get_db() as db:
+    with get_read_db() as db:
         cur = db.execute("SELECT rsn FROM user_activity WHERE private=1")
         results = cur.fetchall()
-        rsns = [f"- {row[0]}" for row in results]
-        message = "### Users with private Alogs:\n" + "\n".join(rsns)
-        if len(rsns) == 0:
-            message += "None"
-        await interaction.response.send_message(message, ephemeral=True)
+    rsns = [f"- {row[0]}" for row in results]
+    message = "### Users with private Alogs:\n" + "\n".join(rsns)
+    if len(rsns) == 0:
+        message += "None"
+    await interaction.response.send_message(message, ephemeral=True)
 
 @discord_client.tree.command(name="user-status", description="Print cap/scan information about a user. If no user is specified it will dump info for all users.")
 async def user_status(interaction:discord.Interaction, rsn:str=None):
-    with get_db() as db:
+    with get_read_db() as db:
         if rsn is not None:
             cur = db.execute("""
                 SELECT
@@ -324,16 +352,6 @@ async def user_status(interaction:discord.Interaction, rsn:str=None):
                 WHERE ua.rsn = ? COLLATE NOCASE;
                 """, (rsn,))
             result = cur.fetchone()
-            if result:
-                message = f"### User Status For {rsn}:\n"
-                message += f"Last Activity Time: {format_timestamp_for_discord(int(result[0]))}\n"
-                message += f"Last Scan Time: {format_timestamp_for_discord(int(result[1]))}\n"
-                message += f"Last Cap Time: {format_timestamp_for_discord(int(result[3])) if result[3] else "Unknown"}\n"
-                message += f"Private ALog?: {'Yes' if result[2] == 1 else '`No`'}\n"
-                await interaction.response.send_message(message, ephemeral=True)
-            else:
-                await interaction.response.send_message(f"No matching rsn found.", ephemeral=True)
-        
         else: # all users
             cur = db.execute("""
                 SELECT
@@ -352,28 +370,41 @@ async def user_status(interaction:discord.Interaction, rsn:str=None):
                 ORDER BY ua.last_query_timestamp DESC
                 """)
             results = cur.fetchall()
-            if not results:
-                await interaction.response.send_message("No records found.", ephemeral=True)
-                return
-
-            formatted_rows = [
-                [
-                    user_rsn,
-                    timestamp_to_date(int(last_activity)),
-                    timestamp_to_date(int(last_query)),
-                    timestamp_to_date(int(last_cap)) if last_cap else "Unknown",
-                    "Yes" if is_private == 1 else "No"
-                ]
-                for user_rsn, last_activity, last_query, is_private, last_cap in results
+
+    if rsn is not None:
+        if result:
+            message = f"### User Status For {rsn}:\n"
+            message += f"Last Activity Time: {format_timestamp_for_discord(int(result[0]))}\n"
+            message += f"Last Scan Time: {format_timestamp_for_discord(int(result[1]))}\n"
+            message += f"Last Cap Time: {format_timestamp_for_discord(int(result[3])) if result[3] else "Unknown"}\n"
+            message += f"Private ALog?: {'Yes' if result[2] == 1 else '`No`'}\n"
+            await interaction.response.send_message(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(f"No matching rsn found.", ephemeral=True)
+    
+    else: # all users
+        if not results:
+            await interaction.response.send_message("No records found.", ephemeral=True)
+            return
+
+        formatted_rows = [
+            [
+                user_rsn,
+                timestamp_to_date(int(last_activity)),
+                timestamp_to_date(int(last_query)),
+                timestamp_to_date(int(last_cap)) if last_cap else "Unknown",
+                "Yes" if is_private == 1 else "No"
             ]
-            with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
-                temp_filename = f.name
-                table = create_table(["Rsn", "Last Activity Date", "Last Scan Date", "Last Cap Date", "Private ALog"], formatted_rows)
-                f.write(table)
-            try:
-                await interaction.response.send_message("Full user status summary:", file=discord.File(temp_filename), ephemeral=True)
-            finally:
-                os.remove(temp_filename)
+            for user_rsn, last_activity, last_query, is_private, last_cap in results
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            temp_filename = f.name
+            table = create_table(["Rsn", "Last Activity Date", "Last Scan Date", "Last Cap Date", "Private ALog"], formatted_rows)
+            f.write(table)
+        try:
+            await interaction.response.send_message("Full user status summary:", file=discord.File(temp_filename), ephemeral=True)
+        finally:
+            os.remove(temp_filename)
 
 
 def run_bot():
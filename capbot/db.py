@@ -1,8 +1,27 @@
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
+
+from log import LOG_NAME
+
+_db_lock = threading.Lock()
+_db_con:sqlite3.Connection|None = None
+_read_con:sqlite3.Connection|None = None
+
+def add_missing_columns(cur:sqlite3.Cursor, table:str, columns:dict[str, str]):
+    """ Adds any of the columns (name -> type) that don't already exist in the table, so older databases pick up new columns. """
+    existing_columns = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns.items():
+        if name not in existing_columns:
+            logging.getLogger(LOG_NAME).info("Adding missing column %s to %s", name, table)
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
 
 def init_db():
     con = sqlite3.connect("capdata.db")
+    # WAL is persisted in the database file so only needs setting once. It avoids an fsync per commit on the rollback journal
+    # and lets the slash commands read while the update task is writing.
+    con.execute("PRAGMA journal_mode=WAL")
     with con:
         cur = con.cursor()
         cur.execute("""
@@ -12,15 +31,21 @@ def init_db():
                 cap_timestamp INTEGER NOT NULL,
                 source TEXT,
                 manual_user TEXT,
+                cap_date TEXT,
                 
                 UNIQUE(rsn, cap_timestamp)
             )
         """)
 
+        # Pre-formatted (RS Alog format) date so /caplist doesn't need to re-format every timestamp.
+        add_missing_columns(cur, "cap_events", {"cap_date": "TEXT"})
+
         # Index for primary query we do in /caplist
         cur.execute("CREATE INDEX IF NOT EXISTS idx_cap_query ON cap_events(rsn,cap_timestamp)")
 
-        # TODO: support adding missing columns.
+        # Index for the date range scans in /caplist and /captotal
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_cap_timestamp ON cap_events(cap_timestamp DESC)")
+
         cur.execute("""
             CREATE TABLE IF NOT EXISTS user_activity(
                 rsn TEXT PRIMARY KEY,
@@ -34,5 +59,38 @@ def init_db():
         # which cannot be more than a few hundred.
     con.close()
 
+def _connect(check_same_thread:bool) -> sqlite3.Connection:
+    con = sqlite3.connect("capdata.db", check_same_thread=check_same_thread)
+    # These are per-connection settings. NORMAL is still crash-safe in WAL mode but skips the fsync on every commit.
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-20000") # ~20MB
+    return con
+
+@contextmanager
 def get_db():
-    return sqlite3.connect("capdata.db", check_same_thread=True)
+    """
+    Yields the shared read/write connection inside a transaction, which is committed on success or rolled back on error.
+    The connection is opened once and kept for the life of the bot so the pragmas and page cache persist between uses.
+    It's used from the update task's worker threads, so access is serialized with a lock. Writes can wait on the database
+    lock while holding it, so don't use this from the event loop; use get_read_db instead.
+    """
+    global _db_con
+    with _db_lock:
+        if _db_con is None:
+            _db_con = _connect(check_same_thread=False)
+
+        with _db_con:
+            yield _db_con
+
+@contextmanager
+def get_read_db():
+    """
+    Yields the read-only connection used by the slash commands on the event loop.
+    It never takes the writer's lock; WAL lets it read while the update task is mid-transaction.
+    """
+    global _read_con
+    if _read_con is None:
+        _read_con = _connect(check_same_thread=True)
+        _read_con.execute("PRAGMA query_only=ON")
+    yield _read_con
@@ -3,7 +3,7 @@ from logging.handlers import RotatingFileHandler
 
 LOG_NAME = "CapBot"
 
-def init_log(mode="w"):
+def init_log():
     log = logging.getLogger(LOG_NAME)
     log.setLevel(logging.DEBUG)
     formatter = logging.Formatter("%(asctime)s [%(threadName)-12.12s] [%(levelname)-5.5s]  %(message)s")
@@ -13,7 +13,8 @@ def init_log(mode="w"):
     console_handler.setLevel(logging.DEBUG)
     log.addHandler(console_handler)
 
-    file_handler = RotatingFileHandler("capbot.log", encoding="utf-8", mode=mode, maxBytes=1024*1024*10, backupCount=3)
+    # RotatingFileHandler always appends (it forces mode 'a' when maxBytes is set), so restarts never truncate the log.
+    file_handler = RotatingFileHandler("capbot.log", encoding="utf-8", maxBytes=1024*1024*10, backupCount=3)
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.DEBUG)
     log.addHandler(file_handler)
@@ -1,45 +1,153 @@
+import calendar
+import csv
+import functools
+import io
+import orjson
 import requests
+import threading
+import time
 from dataclasses import dataclass
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
 
-@dataclass
+REQUEST_TIMEOUT = (5, 15) # (connect, read) seconds
+
+MIN_RETRY_BACKOFF = 10 # seconds
+
+# time.monotonic() value until which no new requests should be started, as the server is rate limiting us.
+_rate_limited_until = 0.0
+_rate_limit_lock = threading.Lock()
+
+def _pause_requests(seconds:float):
+    global _rate_limited_until
+    with _rate_limit_lock:
+        _rate_limited_until = max(_rate_limited_until, time.monotonic() + seconds)
+
+def get_rate_limited_until() -> float:
+    """ Returns the time.monotonic() value until which new requests should be held off after a 'Too many requests' response. """
+    return _rate_limited_until
+
+class _RateLimitRetry(Retry):
+    """
+    urllib3 retries the first failure immediately, which just earns another 429, so always wait at least MIN_RETRY_BACKOFF.
+    On a 429 it also pauses new requests from every other worker for as long as this one is about to wait.
+    """
+    def get_backoff_time(self) -> float:
+        return max(super().get_backoff_time(), MIN_RETRY_BACKOFF)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        rate_limited = response is not None and response.status == 429
+        try:
+            new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        except MaxRetryError:
+            if rate_limited:
+                _pause_requests(MIN_RETRY_BACKOFF)
+            raise
+
+        if rate_limited:
+            retry_after = new_retry.get_retry_after(response) if self.respect_retry_after_header else None
+            _pause_requests(retry_after or new_retry.get_backoff_time())
+        return new_retry
+
+def _create_session() -> requests.Session:
+    """ Creates a session so connections to the RS servers are kept alive and reused between requests. """
+    session = requests.Session()
+    # Backs off on 'Too many requests' (honouring any Retry-After the server sends) and on transient gateway errors.
+    # Without a Retry-After that's 10, 10, 20, 40 then 80 seconds before giving up on the user.
+    retry = _RateLimitRetry(total=5, backoff_factor=5, status_forcelist={429, 502, 503, 504}, allowed_methods={"GET"}, respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+# requests doesn't guarantee a Session is thread-safe, so each of the update task's worker threads gets its own.
+_thread_local = threading.local()
+
+def _get_session() -> requests.Session:
+    """ Returns the calling thread's session, creating it on first use. """
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _create_session()
+        _thread_local.session = session
+    return session
+
+@dataclass(slots=True, frozen=True)
 class ClanMember:
     rsn:str
     rank:str
     total_xp:int
     kills:int
 
+# The member list uses non-breaking spaces in names, swap them for regular spaces.
+_NBSP_TABLE = str.maketrans({"\xa0": " "})
+
+# clan name -> (etag, last modified, members) from the last successful roster fetch.
+_clan_member_cache:dict[str, tuple[str|None, str|None, list[ClanMember]]] = {}
+
 def fetch_clan_members(clan_name:str) -> list[ClanMember]:
+    """
+    Fetches the clan's member list.
+    The roster rarely changes between updates so we make a conditional request and reuse the last parsed list if it's unchanged.
+    """
     url = f"https://secure.runescape.com/m=clan-hiscores/members_lite.ws?clanName={clan_name}"
-    response = requests.get(url)
-    response.raise_for_status()
-    content = response.text
+    headers = {}
+    cached = _clan_member_cache.get(clan_name)
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
 
-    clan_members:list[ClanMember] = []
-    rows = content.split("\n")
-    for row in rows[1:]:
-        entry = row.split(",")
-        if len(entry) < 4:
-            continue
+    response = _get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached is not None:
+        return list(cached[2])
+    response.raise_for_status()
 
-        clan_members.append(ClanMember(
-            rsn=entry[0].replace("\xa0", " ").strip(),
+    reader = csv.reader(io.StringIO(response.text, newline=""))
+    next(reader, None) # skip the header row
+    clan_members = [
+        ClanMember(
+            rsn=entry[0].translate(_NBSP_TABLE).strip(),
             rank=entry[1].strip(),
             total_xp=int(entry[2]),
             kills=int(entry[3])
-        ))
-    return clan_members
+        )
+        for entry in reader if len(entry) >= 4
+    ]
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        _clan_member_cache[clan_name] = (etag, last_modified, clan_members)
+    else:
+        # Nothing to validate against next time, so don't keep sending (and trusting) the old validators.
+        _clan_member_cache.pop(clan_name, None)
+    return list(clan_members)
 
-@dataclass
-class Activity:
-    date:str
-    details:str
-    text:str
+_MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6, "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
 
-@dataclass
+@functools.lru_cache(maxsize=4096)
+def get_date_timestamp(date:str) -> int:
+    """
+    Parses the date from a date string (RS Alog format) and returns it as a timestamp.
+    The format is fixed ("%d-%b-%Y %H:%M", always UTC) so we slice it by hand rather than going through strptime.
+    """
+    day = int(date[0:2])
+    month = _MONTHS[date[3:6]]
+    year = int(date[7:11])
+    hour = int(date[12:14])
+    minute = int(date[15:17])
+    return calendar.timegm((year, month, day, hour, minute, 0))
+
+CAP_TEXT = "Capped at my Clan Citadel."
+
+@dataclass(slots=True, frozen=True)
 class ActivityLog:
     private:bool
-    activities:list[Activity]
+    latest_date:str|None # date of the most recent activity, None if there were no activities
+    cap_dates:tuple[str, ...] # dates of any citadel cap activities
 
 class PrivateProfileException(Exception):
     pass
@@ -47,12 +155,17 @@ class PrivateProfileException(Exception):
 class RuneMetricsApiError(Exception):
     pass
 
-def fetch_user_activites(rsn:str, num_activities:int=20) -> list[Activity]:
+def fetch_user_cap_activities(rsn:str, num_activities:int=20, last_cap_timestamp:int=0) -> ActivityLog:
+    """
+    Fetches the user's last N activities and returns the dates of their cap events along with the date of their latest activity.
+    We filter while walking the json so we don't build objects for activities we'd only throw away.
+    Activities at or before last_cap_timestamp (the latest cap we've already recorded) are skipped.
+    """
     encoded_rsn = quote(rsn)
     url = f"https://apps.runescape.com/runemetrics/profile/profile?user={encoded_rsn}&activities={num_activities}"
-    response = requests.get(url)
+    response = _get_session().get(url, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
-    jdata = response.json()
+    jdata = orjson.loads(response.content) # parse the raw utf-8 bytes directly rather than decoding to str first
     if "error" in jdata:
         error_message = jdata['error']
         if error_message == "PROFILE_PRIVATE":
@@ -60,22 +173,22 @@ def fetch_user_activites(rsn:str, num_activities:int=20) -> list[Activity]:
         else:
             raise RuneMetricsApiError(f"Error fetching alog for {rsn}: {jdata['error']}")
     
-    activities = jdata.get("activities")
-    if activities is None:
-        return []
-    
-    activity_list:list[Activity] = []
-    for activity in activities:
-        activity_list.append(Activity(
-            date=activity["date"],
-            details=activity["details"],
-            text=activity["text"]
-        ))
-    return activity_list
-
-def get_cap_events(activities:list[Activity]) -> list[Activity]:
-    cap_events = []
+    # Nearly every profile has activities, so just try the lookups rather than checking first.
+    try:
+        activities = jdata["activities"] or [] # can be null for profiles with no activity
+    except KeyError:
+        return ActivityLog(private=False, latest_date=None, cap_dates=())
+    try:
+        latest_activity = activities[0] # activities are returned newest first
+    except IndexError:
+        return ActivityLog(private=False, latest_date=None, cap_dates=())
+    latest_date = latest_activity["date"]
+
+    cap_dates = []
     for activity in activities:
-        if activity.text == "Capped at my Clan Citadel.":
-            cap_events.append(activity)
-    return cap_events
\ No newline at end of file
+        # Activities are newest first, so once we reach the last recorded cap everything after it is old.
+        if get_date_timestamp(activity["date"]) <= last_cap_timestamp:
+            break
+        if activity["text"] == CAP_TEXT:
+            cap_dates.append(activity["date"])
+    return ActivityLog(private=False, latest_date=latest_date, cap_dates=tuple(cap_dates))
@@ -16,8 +16,8 @@ def start_linux(log):
     )
 
     with context:
-        # The daemon context closes any open file descriptors. So re-open the long without truncating.
-        log = init_log(mode="a")
+        # The daemon context closes any open file descriptors. So re-open the log.
+        log = init_log()
         log.info("Starting bot daemon")
         run_bot()
 